@@ -1,9 +1,11 @@
 import os
+import gc
 import pandas as pd
 import numpy as np
 import warnings
 import joblib
 import shutil
+import tempfile
 from sklearn.ensemble import IsolationForest
 import kagglehub
 import time
@@ -15,9 +17,35 @@ RESULTS_DIR = "/results"
 DATA_FILE = "predictive_maintenance.csv"
 FILE_PATH = os.path.join(DATA_DIR, DATA_FILE)
 MODEL_SAVE_PATH = os.path.join(RESULTS_DIR, "isolation_forest_model.joblib")
+ONNX_SAVE_PATH = os.path.join(RESULTS_DIR, "isolation_forest_model.onnx")
 
-# Suppress warnings for cleaner logs
-warnings.filterwarnings('ignore')
+# Seeds both the synthetic humidity noise and the Isolation Forest
+RANDOM_SEED = 42
+rng = np.random.default_rng(RANDOM_SEED)
+
+# Only the raw columns the features are built from are read from the CSV
+RAW_COLUMNS = {
+    'Air temperature [K]': np.float32,
+    'Rotational speed [rpm]': np.float32,
+}
+
+# Prefer the multithreaded Arrow CSV reader, fall back to pandas' C parser
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# ONNX export for the API's onnxruntime inference path (optional)
+try:
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+except ImportError:
+    convert_sklearn = None
+
+# Silence sklearn deprecation noise only; pandas performance warnings stay visible
+warnings.filterwarnings('ignore', category=FutureWarning, module='sklearn')
+warnings.simplefilter('default', category=pd.errors.PerformanceWarning)
 
 def load_data():
     """
@@ -61,7 +89,12 @@ def load_data():
     # Load the file (whether it was just downloaded or was already there)
     print(f"Reading data from: {FILE_PATH}")
     try:
-        df = pd.read_csv(FILE_PATH)
+        df = pd.read_csv(
+            FILE_PATH,
+            usecols=list(RAW_COLUMNS),
+            dtype=RAW_COLUMNS,
+            engine=CSV_ENGINE,
+        )
         print("Dataset loaded successfully!")
         print(f"Shape: {df.shape}")
         return df
@@ -72,67 +105,122 @@ def load_data():
 def engineer_features(df):
     print("\n--- [2/5] Feature Engineering ---")
     
-    # 1. Select the raw columns we need
-    features_df = df[['Air temperature [K]', 'Rotational speed [rpm]']].copy()
-    
+    # 1. load_data already projected the CSV onto the raw columns we need
     # 2. Rename the Rotational Speed
-    features_df.rename(columns={
+    features_df = df.rename(columns={
         'Rotational speed [rpm]': 'sound_volume_proxy'
-    }, inplace=True)
+    })
 
     # 3. Create the Celsius column from the Kelvin column
     # Explicitly creating a new column avoids "lying variables"
-    features_df['temperature_celsius'] = features_df['Air temperature [K]'] - 273.15
+    features_df['temperature_celsius'] = features_df['Air temperature [K]'].to_numpy() - 273.15
 
     # DEBUG PRINT: Verify the conversion
     print("\n[DEBUG] Checking Celsius Conversion (First 5):")
     print(features_df[['Air temperature [K]', 'temperature_celsius']].head(5).to_string())
 
     # 4. Drop the Kelvin column safely
-    features_df.drop(columns=['Air temperature [K]'], inplace=True)
+    features_df = features_df.drop(columns=['Air temperature [K]'])
 
     # 5. Generate synthetic 'humidity'
     print("Generating synthetic humidity feature...")
     base_humidity = 45.0
-    temp_mean = features_df['temperature_celsius'].mean()
-    rpm_mean = features_df['sound_volume_proxy'].mean()
+    temp = features_df['temperature_celsius'].to_numpy()
+    rpm = features_df['sound_volume_proxy'].to_numpy()
+    temp_mean = temp.mean(dtype=np.float64)
+    rpm_mean = rpm.mean(dtype=np.float64)
 
     temp_weight = -0.5
     rpm_weight = 0.005 
 
-    features_df['humidity'] = (
-        base_humidity + \
-        (features_df['temperature_celsius'] - temp_mean) * temp_weight + \
-        (features_df['sound_volume_proxy'] - rpm_mean) * rpm_weight
-    )
+    # Build humidity in one preallocated array with in-place ufuncs
+    humidity = np.empty_like(temp)
+    np.subtract(temp, temp_mean, out=humidity)
+    humidity *= temp_weight
+    rpm_term = np.subtract(rpm, rpm_mean, dtype=humidity.dtype)
+    rpm_term *= rpm_weight
+    humidity += rpm_term
+    humidity += base_humidity
 
     # Add noise & Clip
-    noise = np.random.uniform(-2.5, 2.5, size=len(features_df))
-    features_df['humidity'] += noise
-    features_df['humidity'] = features_df['humidity'].clip(0, 100)
+    humidity += rng.uniform(-2.5, 2.5, size=humidity.size)
+    np.clip(humidity, 0, 100, out=humidity)
+    features_df['humidity'] = humidity
     
     # Re-order columns explicitly to ensure consistency for training
     features_df = features_df[['sound_volume_proxy', 'temperature_celsius', 'humidity']]
 
+    # Parameters the API needs to reproduce the humidity feature at inference time
+    humidity_params = {
+        "base_humidity": base_humidity,
+        "temp_mean": float(temp_mean),
+        "rpm_mean": float(rpm_mean),
+        "temp_weight": temp_weight,
+        "rpm_weight": rpm_weight,
+    }
+
     print("Feature engineering complete.")
     print(features_df.describe().to_string()) 
-    return features_df
+    return features_df, humidity_params
 
 def train_model(features_df):
     print("\n--- [3/5] Training Isolation Forest ---")
-    # Save the feature names to ensure alignment during prediction (conceptually)
+    # Column order is the contract with the API: ['sound_volume_proxy', 'temperature_celsius', 'humidity']
     print(f"Training on features: {list(features_df.columns)}")
     
-    model = IsolationForest(n_estimators=100, contamination=0.05, random_state=42)
-    model.fit(features_df)
+    model = IsolationForest(n_estimators=100, contamination=0.05, random_state=RANDOM_SEED, n_jobs=-1)
+    # Fit on a plain float32 ndarray: no feature-name checks at inference, and
+    # sklearn's trees work in float32 internally so no conversion copy is made
+    model.fit(features_df.to_numpy(dtype=np.float32))
     print("Model training complete.")
     return model
 
-def save_model(model):
+def replace_atomically(path, write):
+    """
+    Writes a file via `write(tmp_path)` next to `path`, then renames it into place.
+    A running API keeps its (memory-mapped) old file: the old inode is never truncated.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def save_model(model, humidity_params):
     print("\n--- [4/5] Saving Model ---")
-    joblib.dump(model, MODEL_SAVE_PATH)
+    # The humidity parameters travel with the model so the API never drifts from training
+    # Stored uncompressed so the API can memory-map the arrays (mmap_mode is ignored for compressed files)
+    artifact = {"model": model, "humidity_params": humidity_params}
+    replace_atomically(MODEL_SAVE_PATH, lambda tmp_path: joblib.dump(artifact, tmp_path, compress=0))
     print(f"Model saved to: {MODEL_SAVE_PATH}")
 
+def export_onnx(model):
+    """
+    Exports the model to ONNX so the API can score it with onnxruntime.
+    The 'scores' output matches model.decision_function.
+    """
+    if convert_sklearn is None:
+        print("skl2onnx not installed, skipping ONNX export.")
+        # Never leave an export from a previous model next to the new one
+        if os.path.exists(ONNX_SAVE_PATH):
+            os.remove(ONNX_SAVE_PATH)
+        return
+
+    onnx_model = convert_sklearn(
+        model,
+        initial_types=[('X', FloatTensorType([None, model.n_features_in_]))],
+        target_opset={'': 17, 'ai.onnx.ml': 3},
+    )
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(onnx_model.SerializeToString())
+    replace_atomically(ONNX_SAVE_PATH, write)
+    print(f"ONNX model saved to: {ONNX_SAVE_PATH}")
+
 def run_simulation(model):
     print("\n--- [5/5] Running Real-Time Simulation ---")
     
@@ -156,35 +244,36 @@ def run_simulation(model):
         }
     ]
 
-    for item in simulated_stream:
-        print(f"\n[STREAM] New sensor data: {item['description']}")
-        
-        # Prepare data for prediction
+    # Prepare the whole stream as a single batch (one tree traversal for all rows),
+    # in training column order: ['sound_volume_proxy', 'temperature_celsius', 'humidity']
+    batch = np.empty((len(simulated_stream), 3), dtype=np.float32)
+    for i, item in enumerate(simulated_stream):
         data = item['data']
-        
-        input_df = pd.DataFrame([[
-            data['sound_volume_proxy'], 
-            data['temperature_celsius'], 
-            data['humidity']
-        ]], columns=['sound_volume_proxy', 'temperature_celsius', 'humidity'])
+        batch[i, 0] = data['sound_volume_proxy']
+        batch[i, 1] = data['temperature_celsius']
+        batch[i, 2] = data['humidity']
 
-        try:
-            prediction = model.predict(input_df)
-            anomaly_score = model.decision_function(input_df)
-            is_anomaly = True if prediction[0] == -1 else False
-            
-            score_val = round(anomaly_score[0], 4)
+    try:
+        # decision_function is thresholded at 0, so predict() == -1 <=> score < 0
+        # Scored sequentially: for a handful of rows a joblib thread pool costs more than it saves
+        anomaly_scores = model.decision_function(batch)
+        anomalies = anomaly_scores < 0
+    except Exception as e:
+        print(f"[ERROR] Prediction failed: {e}")
+        # Print expected features for debugging
+        print(f"Model expects {model.n_features_in_} features: "
+              "['sound_volume_proxy', 'temperature_celsius', 'humidity']")
+        return
 
-            if is_anomaly:
-                print(f"[RESULT] ANOMALY DETECTED (Score: {score_val}) - Alert sent!")
-            else:
-                print(f"[RESULT] Normal Operation (Score: {score_val})")
-                
-        except Exception as e:
-            print(f"[ERROR] Prediction failed: {e}")
-            # Print expected features for debugging
-            if hasattr(model, "feature_names_in_"):
-                print(f"Model expects: {model.feature_names_in_}")
+    for item, score, is_anomaly in zip(simulated_stream, anomaly_scores, anomalies):
+        print(f"\n[STREAM] New sensor data: {item['description']}")
+
+        score_val = round(score, 4)
+
+        if is_anomaly:
+            print(f"[RESULT] ANOMALY DETECTED (Score: {score_val}) - Alert sent!")
+        else:
+            print(f"[RESULT] Normal Operation (Score: {score_val})")
 
         time.sleep(1) 
 
@@ -195,13 +284,18 @@ def main():
         return
 
     # 2. Engineer
-    features_df = engineer_features(df)
+    features_df, humidity_params = engineer_features(df)
+
+    # Release the raw frame before the forest allocates its own buffers
+    del df
+    gc.collect()
 
     # 3. Train
     model = train_model(features_df)
 
     # 4. Save
-    save_model(model)
+    save_model(model, humidity_params)
+    export_onnx(model)
 
     # 5. Simulate
     run_simulation(model)
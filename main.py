@@ -1,11 +1,29 @@
 import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import joblib
-import pandas as pd
 import numpy as np
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 
+# Numba compiles the per-row feature kernel to native code; without it the
+# kernel simply runs as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# onnxruntime scores the exported model with less per-call overhead than sklearn;
+# without it (or without an up-to-date export) the API falls back to sklearn
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 # Import your existing logic (assuming we rename your old script to 'pipeline_logic.py' or keep it in same file)
 # For simplicity, I will re-implement the core logic here to keep it self-contained in the API.
 
@@ -13,6 +31,41 @@ from contextlib import asynccontextmanager
 DATA_DIR = "/data"
 RESULTS_DIR = "/results"
 MODEL_PATH = os.path.join(RESULTS_DIR, "isolation_forest_model.joblib")
+ONNX_MODEL_PATH = os.path.join(RESULTS_DIR, "isolation_forest_model.onnx")
+
+# Synthetic humidity parameters are saved with the model by from_model_to_production.py.
+# These defaults (observed on the training data) are only used for older artifacts
+# that contain the bare model.
+DEFAULT_HUMIDITY_PARAMS = {
+    "base_humidity": 45.0,
+    "temp_mean": 26.85,
+    "rpm_mean": 1538.0,
+    "temp_weight": -0.5,
+    "rpm_weight": 0.005,
+}
+
+# Inference concurrency: one pool thread per core, each scoring single-threaded, so
+# the pool never runs more model threads than there are cores
+INFERENCE_WORKERS = os.cpu_count() or 1
+# Large batches are split into chunks of this many rows and scored in parallel across the pool
+# (below roughly 1k rows splitting any further costs more than it saves)
+SCORE_CHUNK_ROWS = 1000
+
+# Prediction cache: inputs are quantized to 0.1 K and 10 rpm before lookup
+SCORE_CACHE_SIZE = 4096
+TEMP_K_STEP = 0.1
+RPM_STEP = 10.0
+# Sensor jitter is drawn up front from a seeded PCG64 generator and consumed round-robin.
+# The seed differs from simulate_sensors.py so client and server noise are independent
+NOISE_SEED = 1
+NOISE_BUFFER_SIZE = 1 << 14  # power of two, so the index wraps with a bit mask
+# Larger batches would wrap the jitter buffer and reuse values within one batch
+MAX_BATCH_SIZE = NOISE_BUFFER_SIZE
+# Readings must be finite and representable in the float32 features the model scores
+MAX_READING = float(np.finfo(np.float32).max)
+# Normal operating envelope swept at startup (matches simulate_sensors.py)
+WARMUP_TEMP_K_RANGE = (297.5, 302.5)
+WARMUP_RPM_RANGE = (1450.0, 1550.0)
 
 # --- DATA MODELS (Pydantic) ---
 class SensorReading(BaseModel):
@@ -30,83 +83,323 @@ ml_models = {}
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load model on startup
+    humidity_params = DEFAULT_HUMIDITY_PARAMS
     if os.path.exists(MODEL_PATH):
         print(f"Loading model from {MODEL_PATH}...")
-        ml_models["isolation_forest"] = joblib.load(MODEL_PATH)
+        # Read-only memory map: only the small per-estimator arrays stay mapped and shared
+        # across workers; sklearn copies each tree's node/value arrays into private memory
+        artifact = joblib.load(MODEL_PATH, mmap_mode="r")
+        if isinstance(artifact, dict):
+            ml_models["isolation_forest"] = artifact["model"]
+            humidity_params = artifact["humidity_params"]
+        else:
+            print("Model artifact has no humidity parameters, using defaults.")
+            ml_models["isolation_forest"] = artifact
     else:
         print("Model not found! Please run the training script first or ensure persistence.")
         # In a real scenario, we might trigger training here, but for now we warn.
         ml_models["isolation_forest"] = None
+    ml_models["humidity_params"] = humidity_params
+    ml_models["onnx_session"] = load_onnx_session()
+
+    # Compile the feature kernel now rather than on the first request
+    ml_models["feature_kernel"] = make_feature_kernel(humidity_params)
+    ml_models["feature_kernel"](300.0, 1500.0, 0.0)
+
+    # Dedicated pool for blocking model calls, sized to the CPU cores, so the
+    # event loop only parses requests and builds responses
+    ml_models["inference_pool"] = ThreadPoolExecutor(
+        max_workers=INFERENCE_WORKERS, thread_name_prefix="inference"
+    )
+
+    if ml_models["isolation_forest"] is not None:
+        warm_score_cache()
     yield
     # Clean up on shutdown
+    ml_models["inference_pool"].shutdown()
+    score_cache.clear()
     ml_models.clear()
 
 app = FastAPI(lifespan=lifespan)
 
 # --- HELPER FUNCTIONS ---
+# Per-thread (1, 3) feature buffer, reused across requests instead of building a DataFrame.
+# Column order matches training: ['sound_volume_proxy', 'temperature_celsius', 'humidity']
+_buffers = threading.local()
+
+_rng = np.random.default_rng(NOISE_SEED)
+_noise_values = _rng.uniform(-0.5, 0.5, NOISE_BUFFER_SIZE)
+_noise = _noise_values.tolist()
+_noise_next = 0
+_noise_lock = threading.Lock()
+
+def _reserve_noise(n):
+    """Claims the next n jitter slots so concurrent callers never share values."""
+    global _noise_next
+    with _noise_lock:
+        start = _noise_next
+        _noise_next = (start + n) & (NOISE_BUFFER_SIZE - 1)
+    return start
+
+def _feature_buffer():
+    buf = getattr(_buffers, "row", None)
+    if buf is None:
+        buf = _buffers.row = np.empty((1, 3), dtype=np.float32)
+    return buf
+
+def make_feature_kernel(humidity_params):
+    """
+    Builds the feature kernel for a single data point: (temp_k, rpm, noise) -> (rpm, temp_c, humidity).
+    The humidity parameters are closed over, so Numba compiles them in as constants.
+    """
+    base_humidity = humidity_params["base_humidity"]
+    temp_mean = humidity_params["temp_mean"]
+    rpm_mean = humidity_params["rpm_mean"]
+    temp_weight = humidity_params["temp_weight"]
+    rpm_weight = humidity_params["rpm_weight"]
+
+    # Not cached on disk: the constants differ per model artifact
+    @njit(fastmath=True)
+    def engineer(temp_k, rpm, noise):
+        # 1. Kelvin to Celsius
+        temp_c = temp_k - 273.15
+        
+        # 2. Synthetic Humidity (The Multiparametric Function)
+        humidity = (
+            base_humidity + 
+            (temp_c - temp_mean) * temp_weight + 
+            (rpm - rpm_mean) * rpm_weight +
+            noise
+        )
+        
+        # Clip
+        if humidity < 0.0:
+            humidity = 0.0
+        elif humidity > 100.0:
+            humidity = 100.0
+        return rpm, temp_c, humidity
+
+    return engineer
+
 def engineer_single_row(temp_k, rpm):
     """
     Replicates the feature engineering logic for a single data point.
+    Runs the compiled kernel and fills a reusable NumPy buffer (no pandas on the hot path).
     """
-    # 1. Create DataFrame
-    df = pd.DataFrame([[temp_k, rpm]], columns=['Air temperature [K]', 'Rotational speed [rpm]'])
-    
-    # 2. Rename
-    df.rename(columns={'Rotational speed [rpm]': 'sound_volume_proxy'}, inplace=True)
-    
-    # 3. Kelvin to Celsius
-    df['temperature_celsius'] = df['Air temperature [K]'] - 273.15
-    df.drop(columns=['Air temperature [K]'], inplace=True)
+    # Add slight random noise (simulating sensor jitter)
+    noise = _noise[_reserve_noise(1)]
     
-    # 4. Synthetic Humidity (The Multiparametric Function)
-    base_humidity = 45.0
-    # We use hardcoded means here based on your training data observations 
-    # (In production, these would be loaded from a config file)
-    temp_mean = 26.85 
-    rpm_mean = 1538.0
+    # Fill the buffer in training order
+    buf = _feature_buffer()
+    buf[0, 0], buf[0, 1], buf[0, 2] = ml_models["feature_kernel"](float(temp_k), float(rpm), noise)
+    return buf
+
+def engineer_batch(temp_k, rpm):
+    """
+    Vectorized engineer_single_row: maps arrays of raw readings to an (N, 3) float32 matrix.
+    """
+    n = len(temp_k)
     
-    temp_weight = -0.5
-    rpm_weight = 0.005
+    # 1. Kelvin to Celsius
+    temp_c = temp_k - 273.15
     
+    # 2. Synthetic Humidity, with a reserved run of n jitter values from the shared buffer
+    start = _reserve_noise(n)
+    noise = _noise_values[(start + np.arange(n)) & (NOISE_BUFFER_SIZE - 1)]
+    params = ml_models["humidity_params"]
     humidity = (
-        base_humidity + 
-        (df['temperature_celsius'] - temp_mean) * temp_weight + 
-        (df['sound_volume_proxy'] - rpm_mean) * rpm_weight
+        params["base_humidity"] + 
+        (temp_c - params["temp_mean"]) * params["temp_weight"] + 
+        (rpm - params["rpm_mean"]) * params["rpm_weight"] +
+        noise
     )
+    np.clip(humidity, 0.0, 100.0, out=humidity)
     
-    # Add slight random noise (simulating sensor jitter)
-    noise = np.random.uniform(-0.5, 0.5)
-    df['humidity'] = (humidity + noise).clip(0, 100)
-    
-    # Reorder to match training: ['sound_volume_proxy', 'temperature_celsius', 'humidity']
-    return df[['sound_volume_proxy', 'temperature_celsius', 'humidity']]
+    # 3. Write into one preallocated float32 matrix in training order
+    features = np.empty((n, 3), dtype=np.float32)
+    features[:, 0] = rpm
+    features[:, 1] = temp_c
+    features[:, 2] = humidity
+    return features
+
+def load_onnx_session():
+    """Opens the ONNX export of the loaded model, if it is available and not stale."""
+    if ort is None or ml_models["isolation_forest"] is None or not os.path.exists(ONNX_MODEL_PATH):
+        return None
+    if os.path.getmtime(ONNX_MODEL_PATH) < os.path.getmtime(MODEL_PATH):
+        print("ONNX model is older than the joblib model, using sklearn.")
+        return None
+    print(f"Loading ONNX model from {ONNX_MODEL_PATH}...")
+    # Each call runs on one thread: parallelism comes from the inference pool instead
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(ONNX_MODEL_PATH, sess_options=options, providers=["CPUExecutionProvider"])
+
+def score(X):
+    """
+    Runs the Isolation Forest on a float32 feature matrix; negative scores are anomalies.
+    The onnxruntime and sklearn paths agree only for finite float32 input (they treat NaN
+    differently), so the endpoints reject non-finite readings before calling this.
+    """
+    session = ml_models["onnx_session"]
+    if session is not None:
+        return session.run(["scores"], {"X": X})[0].ravel()
+
+    # Sequential on purpose: no joblib backend is nested inside the pool threads
+    return ml_models["isolation_forest"].decision_function(X)
+
+async def run_inference(func, *args):
+    """Runs a blocking model call on the inference pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ml_models["inference_pool"], func, *args)
+
+async def score_in_chunks(X):
+    """Scores a large matrix as row chunks spread over the inference pool."""
+    if X.shape[0] <= SCORE_CHUNK_ROWS:
+        return await run_inference(score, X)
+    chunks = [X[i:i + SCORE_CHUNK_ROWS] for i in range(0, X.shape[0], SCORE_CHUNK_ROWS)]
+    return np.concatenate(await asyncio.gather(*(run_inference(score, chunk) for chunk in chunks)))
+
+def is_valid_reading(temp_k, rpm):
+    """True for finite readings that fit in float32 (NaN fails every comparison)."""
+    return abs(temp_k) <= MAX_READING and abs(rpm) <= MAX_READING
+
+def quantize(temp_k, rpm):
+    """Maps a raw reading onto the prediction cache grid."""
+    return round(temp_k / TEMP_K_STEP), round(rpm / RPM_STEP)
+
+class ScoreCache:
+    """
+    Bounded LRU map from a quantized reading to its anomaly score.
+    Only used from the event loop, so it needs no locking.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+
+    def get(self, key):
+        anomaly_score = self._scores.get(key)
+        if anomaly_score is None:
+            self.misses += 1
+            return None
+        self._scores.move_to_end(key)
+        self.hits += 1
+        return anomaly_score
+
+    def put(self, key, anomaly_score):
+        self._scores[key] = anomaly_score
+        self._scores.move_to_end(key)
+        if len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)
+
+    def clear(self):
+        self._scores.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._scores)}
+
+score_cache = ScoreCache(SCORE_CACHE_SIZE)
+
+def score_reading(temp_k_q, rpm_q):
+    """
+    Scores a quantized reading with the model (the cache-miss path).
+    """
+    processed_data = engineer_single_row(temp_k_q * TEMP_K_STEP, rpm_q * RPM_STEP)
+    return float(score(processed_data)[0])
+
+def warm_score_cache():
+    """Pre-fills the prediction cache over the expected normal operating grid in one model call."""
+    temp_lo, rpm_lo = quantize(WARMUP_TEMP_K_RANGE[0], WARMUP_RPM_RANGE[0])
+    temp_hi, rpm_hi = quantize(WARMUP_TEMP_K_RANGE[1], WARMUP_RPM_RANGE[1])
+    temp_k_q, rpm_q = np.meshgrid(
+        np.arange(temp_lo, temp_hi + 1), np.arange(rpm_lo, rpm_hi + 1), indexing="ij"
+    )
+    temp_k_q = temp_k_q.ravel()
+    rpm_q = rpm_q.ravel()
+
+    anomaly_scores = score(engineer_batch(temp_k_q * TEMP_K_STEP, rpm_q * RPM_STEP))
+    for key, anomaly_score in zip(zip(temp_k_q.tolist(), rpm_q.tolist()), anomaly_scores.tolist()):
+        score_cache.put(key, anomaly_score)
+    print(f"Prediction cache warmed: {score_cache.info()}")
 
 # --- ENDPOINTS ---
 
 @app.get("/")
 def health_check():
-    return {"status": "running", "model_loaded": ml_models["isolation_forest"] is not None}
+    return {
+        "status": "running",
+        "model_loaded": ml_models["isolation_forest"] is not None,
+        "cache": score_cache.info(),
+    }
 
 @app.post("/predict", response_model=PredictionResponse)
-def predict_anomaly(reading: SensorReading):
+async def predict_anomaly(reading: SensorReading):
     if ml_models["isolation_forest"] is None:
         raise HTTPException(status_code=503, detail="Model not loaded.")
+    if not is_valid_reading(reading.temperature_k, reading.rotational_speed_rpm):
+        raise HTTPException(status_code=400, detail="Sensor readings must be finite float32 values.")
     
     # 1. Process Data
     try:
-        processed_data = engineer_single_row(reading.temperature_k, reading.rotational_speed_rpm)
+        temp_k_q, rpm_q = quantize(reading.temperature_k, reading.rotational_speed_rpm)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Feature engineering failed: {str(e)}")
 
-    # 2. Inference
-    model = ml_models["isolation_forest"]
-    prediction = model.predict(processed_data)
-    score = model.decision_function(processed_data)
+    # 2. Inference: cache hits are answered on the event loop, only misses reach the pool
+    key = (temp_k_q, rpm_q)
+    anomaly_score = score_cache.get(key)
+    if anomaly_score is None:
+        anomaly_score = await run_inference(score_reading, temp_k_q, rpm_q)
+        score_cache.put(key, anomaly_score)
     
-    is_anomaly = int(prediction[0] == -1)
+    # decision_function is thresholded at 0, so predict() == -1 <=> score < 0
+    is_anomaly = anomaly_score < 0
     
     return {
         "is_anomaly": is_anomaly,
-        "anomaly_score": round(float(score[0]), 4),
+        "anomaly_score": round(anomaly_score, 4),
         "status": "ALERT" if is_anomaly else "OK"
     }
+
+@app.post("/predict_batch", response_model=list[PredictionResponse])
+async def predict_batch(readings: list[SensorReading]):
+    if ml_models["isolation_forest"] is None:
+        raise HTTPException(status_code=503, detail="Model not loaded.")
+    if not readings:
+        return []
+    if len(readings) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} readings per batch.")
+    
+    # Fill a preallocated array in one pass, no intermediate lists
+    raw = np.empty((len(readings), 2), dtype=np.float64)
+    for i, r in enumerate(readings):
+        raw[i, 0] = r.temperature_k
+        raw[i, 1] = r.rotational_speed_rpm
+    # Same rule as /predict (NaN fails the comparison)
+    if not (np.abs(raw) <= MAX_READING).all():
+        raise HTTPException(status_code=400, detail="Sensor readings must be finite float32 values.")
+
+    # 1. Process Data
+    try:
+        processed_data = engineer_batch(raw[:, 0], raw[:, 1])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Feature engineering failed: {str(e)}")
+
+    # 2. Inference: one model call per chunk of the batch
+    anomaly_scores = await score_in_chunks(processed_data)
+    
+    # decision_function is thresholded at 0, so predict() == -1 <=> score < 0
+    anomalies = anomaly_scores < 0
+    
+    return [
+        {
+            "is_anomaly": is_anomaly,
+            "anomaly_score": round(anomaly_score, 4),
+            "status": "ALERT" if is_anomaly else "OK"
+        }
+        for anomaly_score, is_anomaly in zip(anomaly_scores.tolist(), anomalies.tolist())
+    ]
@@ -1,51 +1,59 @@
 import time
+import argparse
+import asyncio
+import itertools
 import requests
-import random
 import math
+import numpy as np
 
-API_URL = "http://localhost:8000/predict"
+BASE_URL = "http://localhost:8000"
+API_URL = f"{BASE_URL}/predict"
 
-def generate_stream():
-    """Generates an infinite stream of sensor data."""
+# Sensor noise is drawn in blocks from a seeded PCG64 generator.
+# The seed differs from main.py so client and server noise are independent
+NOISE_SEED = 0
+NOISE_BLOCK = 1024
+
+def generate_stream(verbose=True):
+    """Generates an infinite stream of sensor data. `verbose` announces injected anomalies."""
+    rng = np.random.default_rng(NOISE_SEED)
     t = 0
     while True:
-        # 1. Generate Synthetic Data (Normal)
-        # Temp: Sine wave centered at 300K (approx 27C)
-        temp_k = 300 + (2 * math.sin(t * 0.1)) + random.uniform(-0.5, 0.5)
-        
-        # RPM: Normal around 1500
-        rpm = 1500 + random.uniform(-50, 50)
-        
-        # 2. Inject Anomaly (Every 10th step)
-        if t % 10 == 0 and t > 0:
-            print("\n--- INJECTING ANOMALY (High RPM) ---")
-            rpm = 2800 # Spike!
+        temp_noise = rng.uniform(-0.5, 0.5, NOISE_BLOCK).tolist()
+        rpm_noise = rng.uniform(-50, 50, NOISE_BLOCK).tolist()
+
+        for temp_jitter, rpm_jitter in zip(temp_noise, rpm_noise):
+            # 1. Generate Synthetic Data (Normal)
+            # Temp: Sine wave centered at 300K (approx 27C)
+            temp_k = 300 + (2 * math.sin(t * 0.1)) + temp_jitter
+            
+            # RPM: Normal around 1500
+            rpm = 1500 + rpm_jitter
             
-        yield {"temperature_k": temp_k, "rotational_speed_rpm": rpm}
-        t += 1
+            # 2. Inject Anomaly (Every 10th step)
+            if t % 10 == 0 and t > 0:
+                if verbose:
+                    print("\n--- INJECTING ANOMALY (High RPM) ---")
+                rpm = 2800 # Spike!
+                
+            yield {"temperature_k": temp_k, "rotational_speed_rpm": rpm}
+            t += 1
 
-def main():
-    print(f"Connecting to Factory API at {API_URL}...")
-    
-    # Wait for server
-    try:
-        requests.get("http://localhost:8000/")
-        print("Server is Online.")
-    except:
-        print("Server is offline. Is Docker running?")
-        return
+def print_result(result):
+    status_icon = "ERROR" if result['is_anomaly'] else "WORKING"
+    print(f"API Response:   {status_icon} {result['status']} (Score: {result['anomaly_score']})")
 
+def run_demo(session):
+    """Sends one reading per second over a single keep-alive connection."""
     stream = generate_stream()
     
     for sensor_data in stream:
         print(f"Sensor Sending: {sensor_data}")
         
         try:
-            response = requests.post(API_URL, json=sensor_data)
+            response = session.post(API_URL, json=sensor_data)
             if response.status_code == 200:
-                result = response.json()
-                status_icon = "ERROR" if result['is_anomaly'] else "WORKING"
-                print(f"API Response:   {status_icon} {result['status']} (Score: {result['anomaly_score']})")
+                print_result(response.json())
             else:
                 print(f"Error: {response.status_code} - {response.text}")
         except Exception as e:
@@ -53,5 +61,64 @@ def main():
             
         time.sleep(1) # simulate 1Hz sensor rate
 
+async def tick(client, sensor_data):
+    response = await client.post(API_URL, json=sensor_data)
+    response.raise_for_status()
+    return response.json()
+
+async def run_load_test(concurrency, ticks):
+    """Fires `concurrency` readings per tick concurrently, without pausing between ticks."""
+    import httpx
+
+    stream = generate_stream(verbose=False)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    sent = failed = anomalies = 0
+    start = time.perf_counter()
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        for _ in range(ticks):
+            batch = list(itertools.islice(stream, concurrency))
+            results = await asyncio.gather(
+                *(tick(client, sensor_data) for sensor_data in batch),
+                return_exceptions=True,
+            )
+            for result in results:
+                sent += 1
+                if isinstance(result, Exception):
+                    failed += 1
+                elif result['is_anomaly']:
+                    anomalies += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"Sent {sent} readings in {elapsed:.2f}s ({sent / elapsed:.1f} req/s): "
+          f"{anomalies} anomalies, {failed} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Factory sensor simulation")
+    parser.add_argument("--load-test", action="store_true",
+                        help="send concurrent requests as fast as possible instead of 1Hz")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="requests in flight per tick (load test only)")
+    parser.add_argument("--ticks", type=int, default=100,
+                        help="number of ticks to send (load test only)")
+    args = parser.parse_args()
+
+    print(f"Connecting to Factory API at {API_URL}...")
+    
+    # Reuse one connection for every request instead of reconnecting per call
+    with requests.Session() as session:
+        # Wait for server
+        try:
+            session.get(f"{BASE_URL}/")
+            print("Server is Online.")
+        except:
+            print("Server is offline. Is Docker running?")
+            return
+
+        if args.load_test:
+            asyncio.run(run_load_test(args.concurrency, args.ticks))
+        else:
+            run_demo(session)
+
 if __name__ == "__main__":
     main()